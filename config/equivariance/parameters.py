@@ -1,24 +1,38 @@
-from torch import nn
-from torch.optim import Adam
+def _build_configs():
+    from torch import nn
+    from torch.optim import Adam
 
-configs = {
-    "default": {
-        "model": {
-            "type": "regressor",
-            "params": {"hidden_units": [512, 256]},
+    return {
+        "default": {
+            "model": {
+                "type": "regressor",
+                "params": {"hidden_units": [512, 256]},
+            },
+            "training": {
+                "criterion": nn.MSELoss,
+                "optimizer": {
+                    "class": Adam,
+                    "params": {"lr": 0.001, "weight_decay": 0.01},
+                },
+                "batch_size": 32,
+                "num_epochs": 5,
+                "patience": 3,
+                "feature_aggregation": False,
+            },
+            "evaluation": {
+                "criterion": nn.MSELoss,
+                "feature_aggregation": False,
+                "batch_size": 32,
+            },
         },
-        "training": {
-            "criterion": nn.MSELoss,
-            "optimizer": {"class": Adam, "params": {"lr": 0.001, "weight_decay": 0.01}},
-            "batch_size": 32,
-            "num_epochs": 5,
-            "patience": 3,
-            "feature_aggregation": False,
-        },
-        "evaluation": {
-            "criterion": nn.MSELoss,
-            "feature_aggregation": False,
-            "batch_size": 32,
-        },
-    },
-}
+    }
+
+
+def __getattr__(name):
+    # build configs on first access, so that importing this module
+    # doesn't also import torch
+    if name == "configs":
+        global configs
+        configs = _build_configs()
+        return configs
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,24 @@
-from torch_audiomentations import PitchShift
+def _build_configs():
+    from torch_audiomentations import PitchShift
 
-configs = {
-    "PitchShift": {
-        "class": PitchShift,
-        "params": {
-            "min_transpose_semitones": -12,
-            "max_transpose_semitones": 12,
-            "p": 1,
-            "mode": "per_example",
+    return {
+        "PitchShift": {
+            "class": PitchShift,
+            "params": {
+                "min_transpose_semitones": -12,
+                "max_transpose_semitones": 12,
+                "p": 1,
+                "mode": "per_example",
+            },
         },
-    },
-}
+    }
+
+
+def __getattr__(name):
+    # build configs on first access, so that importing this module
+    # doesn't also import torch_audiomentations (and torch)
+    if name == "configs":
+        global configs
+        configs = _build_configs()
+        return configs
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,9 @@
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Tuple, Union
 
 import mirdata
+import numpy as np
 import torch
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
@@ -11,44 +13,68 @@ from torch.utils.data import Dataset
 from config.features import configs as feature_configs
 from synesis.datasets.dataset_utils import load_track
 
+# Define pitch classes
+_PITCH_CLASSES = {
+    "C": 0,
+    "C#": 1,
+    "Db": 1,
+    "D": 2,
+    "D#": 3,
+    "Eb": 3,
+    "E": 4,
+    "F": 5,
+    "F#": 6,
+    "Gb": 6,
+    "G": 7,
+    "G#": 8,
+    "Ab": 8,
+    "A": 9,
+    "A#": 10,
+    "Bb": 10,
+    "B": 11,
+}
+
+# MIDI note numbers for every single-note pitch string, e.g. "A3" or "A#3".
+# MIDI note numbers start at C-1 (octave = -1) which is MIDI note 0
+_PITCH_TO_MIDI = {
+    f"{pitch_class}{octave}": value + (octave + 1) * 12
+    for pitch_class, value in _PITCH_CLASSES.items()
+    for octave in range(-1, 10)
+}
+
 
 def pitch_to_midi(pitch_str: str) -> int:
     """Convert pitch string to MIDI note number."""
-    # Define pitch classes
-    pitch_classes = {
-        "C": 0,
-        "C#": 1,
-        "Db": 1,
-        "D": 2,
-        "D#": 3,
-        "Eb": 3,
-        "E": 4,
-        "F": 5,
-        "F#": 6,
-        "Gb": 6,
-        "G": 7,
-        "G#": 8,
-        "Ab": 8,
-        "A": 9,
-        "A#": 10,
-        "Bb": 10,
-        "B": 11,
+    return _PITCH_TO_MIDI[pitch_str]
+
+
+@lru_cache(maxsize=None)
+def _stratified_split(paths: tuple, labels: tuple, sizes: tuple, seed: int) -> dict:
+    """Stratified train/validation/test split, cached since the same split is
+    computed every time the dataset is instantiated (e.g. once per split)."""
+    X_train, X_others, y_train, y_others = train_test_split(
+        paths,
+        labels,
+        test_size=1 - sizes[0],
+        random_state=seed,
+        stratify=labels,
+    )
+    X_val, X_test, y_val, y_test = train_test_split(
+        X_others,
+        y_others,
+        test_size=sizes[2] / (sizes[1] + sizes[2]),
+        random_state=seed,
+        stratify=y_others,
+    )
+    return {
+        "X_train": X_train,
+        "X_validation": X_val,
+        "X_test": X_test,
+        "y_train": y_train,
+        "y_validation": y_val,
+        "y_test": y_test,
     }
 
-    # Handle special cases for sharp/flat notes
-    if len(pitch_str) == 3:
-        pitch_class = pitch_str[:2]  # e.g., 'A#' from 'A#3'
-        octave = int(pitch_str[2])
-    else:
-        pitch_class = pitch_str[0]  # e.g., 'A' from 'A3'
-        octave = int(pitch_str[1])
-
-    # Calculate MIDI note number
-    # MIDI note numbers start at C-1 (octave = -1) which is MIDI note 0
-    midi_note = pitch_classes[pitch_class] + (octave + 1) * 12
-
-    return midi_note
-
 
 class TinySOL(Dataset):
     def __init__(
@@ -130,52 +156,29 @@ class TinySOL(Dataset):
         if sum(sizes) != 1:
             raise ValueError("Sizes must add up to 1.")
 
-        X_train, X_others, y_train, y_others = train_test_split(
-            paths,
-            labels,
-            test_size=1 - sizes[0],
-            random_state=seed,
-            stratify=labels,
-        )
-        X_val, X_test, y_val, y_test = train_test_split(
-            X_others,
-            y_others,
-            test_size=sizes[2] / (sizes[1] + sizes[2]),
-            random_state=seed,
-            stratify=y_others,
-        )
-        return {
-            "X_train": X_train,
-            "X_validation": X_val,
-            "X_test": X_test,
-            "y_train": y_train,
-            "y_validation": y_val,
-            "y_test": y_test,
-        }
+        splits = _stratified_split(tuple(paths), tuple(labels), tuple(sizes), seed)
+        # copy, so that the cached split isn't modified through the dataset
+        return {key: list(value) for key, value in splits.items()}
 
     def _load_metadata(self) -> Tuple[list, torch.Tensor]:
-        # load track ids
-        self.track_ids = self.dataset.track_ids
-        # only keep track_ids with single pitch annotations
-        for track_id in self.track_ids:
-            if len(self.dataset.track(track_id).pitch) != 1:
-                self.track_ids.remove(track_id)
+        # only keep tracks with single pitch annotations (after the "F#_"
+        # annotation fix), loading each track once and reusing it for paths
+        # and labels
+        tracks = [
+            (track, pitch_str)
+            for track in self.dataset.load_tracks().values()
+            if (pitch_str := track.pitch.replace("F#_", "F#")) in _PITCH_TO_MIDI
+        ]
+        self.track_ids = [track.track_id for track, _ in tracks]
 
         # load audio paths
-        paths = [self.dataset.track(t_id).audio_path for t_id in self.track_ids]
+        paths = [track.audio_path for track, _ in tracks]
 
         # load labels
-        labels = []
         if self.fv == "pitch":
-            for t_id in self.track_ids:
-                pitch_str = self.dataset.track(t_id).pitch
-                # annotation fix
-                if "F#_" in pitch_str:
-                    pitch_str = pitch_str.replace("F#_", "F#")
-                labels.append(pitch_to_midi(pitch_str))
+            labels = [pitch_to_midi(pitch_str) for _, pitch_str in tracks]
         elif self.fv == "instrument":
-            for t_id in self.track_ids:
-                labels.append(self.dataset.track(t_id).instrument_full)
+            labels = [track.instrument_full for track, _ in tracks]
 
         # load splits
         if self.split:
@@ -183,13 +186,18 @@ class TinySOL(Dataset):
             paths, labels = splits[f"X_{self.split}"], splits[f"y_{self.split}"]
 
         # encode labels
+        # fit_transform already returns an integer array, so wrap it for torch
+        # without copying element-wise through a Python list
         labels = self.label_encoder.fit_transform(labels)
-        labels = torch.tensor(labels, dtype=torch.long)
+        labels = torch.from_numpy(labels.astype(np.int64, copy=False))
 
+        # format the replacement strings once rather than per path
+        audio_ext, audio_dir = f".{self.audio_format}", f"/{self.audio_format}/"
+        feature_dir = f"/{self.feature}/"
         self.feature_paths = [
-            path.replace(f".{self.audio_format}", ".pt")
-            .replace(f"/{self.audio_format}/", f"/{self.feature}/")
-            .replace("/audio/", f"/{self.feature}/")
+            path.replace(audio_ext, ".pt")
+            .replace(audio_dir, feature_dir)
+            .replace("/audio/", feature_dir)
             for path in paths
         ]
         self.raw_data_paths, self.labels = paths, labels
@@ -231,8 +239,6 @@ if __name__ == "__main__":
         },
     )
     # iterate over all items
-    import numpy as np
-
     for _ in range(5):
         idx = np.random.randint(0, len(tinysol))
         item, label = tinysol[idx]
@@ -55,10 +55,10 @@ def preprocess_batch(
                 float(t_param)
                 for t_param in transform_obj.transform_parameters["transpositions"]
             ]
-            # convert to tensor of shape [batch, 1, 1] and move to device
-            transform_params = (
-                torch.tensor(transform_params).unsqueeze(1).unsqueeze(1).to(device)
-            )
+            # build directly on the device, as a tensor of shape [batch, 1, 1]
+            transform_params = torch.tensor(
+                transform_params, dtype=torch.float32, device=device
+            ).view(-1, 1, 1)
         else:
             # they will be of shape [batch, channel, 1], and on device
             transform_params = transform_obj.transform_parameters[
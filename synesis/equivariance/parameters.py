@@ -31,9 +31,12 @@ def preprocess_batch(
     transform,
     feature_extractor,
     device,
+    original_features=None,
 ):
     """Get transformed data, extract features from both the original and
-    transformed data, and concatenate them for input to the model."""
+    transformed data, and concatenate them for input to the model. If
+    original_features are given (e.g. kept from an earlier epoch), only the
+    transformed data goes through the feature extractor."""
 
     if transform in ["HueShift", "BrightnessShift", "SaturationShift"]:
         original_raw_data = batch_raw_data[:, 0].to(device)
@@ -51,10 +54,10 @@ def preprocess_batch(
                 float(t_param)
                 for t_param in transform_obj.transform_parameters["transpositions"]
             ]
-            # convert to tensor of shape [batch, 1, 1] and move to device
-            transform_params = (
-                torch.tensor(transform_params).unsqueeze(1).unsqueeze(1).to(device)
-            )
+            # build directly on the device, as a tensor of shape [batch, 1, 1]
+            transform_params = torch.tensor(
+                transform_params, dtype=torch.float32, device=device
+            ).view(-1, 1, 1)
         else:
             # they will be of shape [batch, channel, 1], and on device
             transform_params = transform_obj.transform_parameters[
@@ -63,6 +66,14 @@ def preprocess_batch(
         if transform_params.dim() == 3:
             transform_params = transform_params.squeeze(1)  # remove channel dim
 
+    if original_features is not None:
+        with torch.no_grad():
+            transformed_features = feature_extractor(transformed_raw_data)
+            if transformed_features.dim() == 2:
+                transformed_features = transformed_features.unsqueeze(1)
+        concat_features = torch.cat([original_features, transformed_features], dim=2)
+        return concat_features, transform_params
+
     # combine original and transformed data
     combined_raw_data = torch.cat([original_raw_data, transformed_raw_data], dim=0)
 
@@ -206,6 +217,10 @@ def train(
     epochs_without_improvement = 0
     best_model_state = None
 
+    # validation batches come in the same order every epoch, so their original
+    # features are extracted once and kept on the device
+    val_original_features = {}
+
     num_epochs = task_config["training"]["num_epochs"]
     for epoch in range(num_epochs):
         model.train()
@@ -243,8 +258,8 @@ def train(
         model.eval()
         total_val_loss = 0
         with torch.no_grad():
-            for batch_raw_data, batch_targets in tqdm(
-                val_loader, desc=f"Epoch {epoch+1}/{num_epochs} - Validation"
+            for i, (batch_raw_data, batch_targets) in enumerate(
+                tqdm(val_loader, desc=f"Epoch {epoch+1}/{num_epochs} - Validation")
             ):
                 # prepare data for equivariance training
                 concat_features, transform_params = preprocess_batch(
@@ -254,7 +269,13 @@ def train(
                     transform=transform,
                     feature_extractor=feature_extractor,
                     device=device,
+                    original_features=val_original_features.get(i),
                 )
+                if i not in val_original_features:
+                    # originals are the first half of the feature axis
+                    val_original_features[i] = concat_features[
+                        ..., : concat_features.shape[2] // 2
+                    ].clone()
 
                 predicted_params = model(concat_features)
                 if len(predicted_params.shape) == 2:
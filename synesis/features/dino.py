@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 from torch import nn
 from transformers import ResNetModel
 
@@ -9,12 +10,24 @@ class DINO(nn.Module):
 
         self.feature_extractor = feature_extractor
 
-        self.model = ResNetModel.from_pretrained("Ramos-Ramos/dino-resnet-50")
+        # load the weights directly, without first materializing a randomly
+        # initialized copy in host memory. They stay fp32, since the device
+        # isn't known yet: bf16 only applies on GPU, via autocast in forward
+        self.model = ResNetModel.from_pretrained(
+            "Ramos-Ramos/dino-resnet-50", low_cpu_mem_usage=True
+        )
+        # NHWC lets cuDNN pick its faster conv kernels
+        self.model = self.model.to(memory_format=torch.channels_last).eval()
 
     def forward(self, x):
         if self.feature_extractor:
+            x = x.to(memory_format=torch.channels_last)
+            # no_grad rather than inference_mode, since the features can be
+            # fed straight into a trainable downstream model
             with torch.no_grad():
-                h = self.model(x)
-                return h
+                with torch.autocast("cuda", dtype=torch.bfloat16, enabled=x.is_cuda):
+                    h = self.model(x).last_hidden_state
+                # (b, c, h, w) -> (b, c)
+                return F.adaptive_avg_pool2d(h, 1).flatten(1).float()
         else:
             raise NotImplementedError("Training not implemented yet.")
@@ -1,5 +1,6 @@
 import importlib
 import os
+from collections import deque
 from pathlib import Path
 
 import numpy as np
@@ -113,62 +114,74 @@ def dynamic_batch_extractor(
     # concatenating new embeddings, so we don't want to interefere with that.
     existing_files = [p for p in dataset.feature_paths if Path(p).exists()]
 
+    def batches():
+        batch = []
+        batch_paths = []
+        for i in range(len(dataset)):
+            x, _ = dataset[i]  # Ignore the label
+            output_path = dataset.feature_paths[i]
+            # skip if output file exists
+            if output_path in existing_files:
+                pbar.update(1)
+                continue
+
+            for buffer in range(0, x.shape[1], item_len):
+                x_item = x[:, buffer : buffer + item_len]
+                if x_item.shape[1] < item_len:
+                    match padding:
+                        case "repeat":
+                            if x_item.shape[1] < item_len:
+                                # repeat the first part of the item, and add it in front
+                                # e.g. if x_item is [1, 2, 3] and item_len is 5, then
+                                # the resulting x_item is [1, 2, 1, 2, 3]
+                                repeated_part = x_item[:, : item_len - x_item.shape[1]]
+                                while x_item.shape[1] < item_len:
+                                    x_item = torch.cat([repeated_part, x_item], dim=1)
+                                x_item = x_item[:, :item_len]
+                        case "zero":
+                            # Implement zero padding
+                            padding_size = item_len - x_item.shape[1]
+                            x_item = torch.nn.functional.pad(x_item, (0, padding_size))
+                        case _:
+                            raise Exception(
+                                f"Padding method '{padding}' not implemented."
+                            )
+                batch.append(x_item)
+                batch_paths.append(output_path)
+
+                if len(batch) == batch_size:
+                    yield torch.stack(batch).to(device), batch_paths
+                    batch = []
+                    batch_paths = []
+
+            pbar.update(1)
+
+        # Process the last batch
+        if len(batch) > 0:
+            while len(batch) < batch_size:
+                batch.append(torch.zeros_like(batch[-1]))
+                batch_paths.append(batch_paths[-1])
+            yield torch.stack(batch).to(device), batch_paths
+
+    # extractors that pipeline consecutive batches (see MDuo.forward_batches)
+    # read ahead, so keep the paths of batches that were read but not saved
+    pending_paths = deque()
+
+    def audio_batches():
+        for batch, batch_paths in batches():
+            pending_paths.append(batch_paths)
+            yield batch
+
     pbar = tqdm(total=len(dataset))
-    batch = []
-    batch_paths = []
     extractor.to(device)
 
-    for i in range(len(dataset)):
-        x, _ = dataset[i]  # Ignore the label
-        output_path = dataset.feature_paths[i]
-        # skip if output file exists
-        if output_path in existing_files:
-            pbar.update(1)
-            continue
-
-        for buffer in range(0, x.shape[1], item_len):
-            x_item = x[:, buffer : buffer + item_len]
-            if x_item.shape[1] < item_len:
-                match padding:
-                    case "repeat":
-                        if x_item.shape[1] < item_len:
-                            # repeat the first part of the item, and add it in front
-                            # e.g. if x_item is [1, 2, 3] and item_len is 5, then
-                            # the resulting x_item is [1, 2, 1, 2, 3]
-                            repeated_part = x_item[:, : item_len - x_item.shape[1]]
-                            while x_item.shape[1] < item_len:
-                                x_item = torch.cat([repeated_part, x_item], dim=1)
-                            x_item = x_item[:, :item_len]
-                    case "zero":
-                        # Implement zero padding
-                        padding_size = item_len - x_item.shape[1]
-                        x_item = torch.nn.functional.pad(x_item, (0, padding_size))
-                    case _:
-                        raise Exception(f"Padding method '{padding}' not implemented.")
-            batch.append(x_item)
-            batch_paths.append(output_path)
-
-            if len(batch) == batch_size:
-                batch = torch.stack(batch)
-                batch = batch.to(device)
-                with torch.no_grad():
-                    embeddings = extractor(batch)
-                save_or_append(embeddings.cpu(), batch_paths)
-                batch = []
-                batch_paths = []
-
-        pbar.update(1)
-
-    # Process the last batch
-    if len(batch) > 0:
-        while len(batch) < batch_size:
-            batch.append(torch.zeros_like(batch[-1]))
-            batch_paths.append(batch_paths[-1])
-        batch = torch.stack(batch)
-        batch = batch.to(device)
-        with torch.no_grad():
-            embeddings = extractor(batch)
-        save_or_append(embeddings.cpu(), batch_paths)
+    if hasattr(extractor, "forward_batches"):
+        outputs = extractor.forward_batches(audio_batches())
+    else:
+        outputs = (extractor(batch) for batch in audio_batches())
+    with torch.no_grad():
+        for embeddings in outputs:
+            save_or_append(embeddings.cpu(), pending_paths.popleft())
 
     pbar.close()
 
@@ -14,8 +14,10 @@ import re
 import torch
 import timm
 from timm.models.layers import trunc_normal_
-from einops import rearrange
-import nnAudio.features
+import torchaudio
+
+# log offset for the (always fp32) mel spectrogram
+_EPS_FP32 = torch.finfo(torch.float32).eps
 
 
 class Config:
@@ -47,6 +49,8 @@ class PatchEmbed(torch.nn.Module):
         embed_dim=768,
         norm_layer=None,
         flatten=True,
+        bias=True,
+        **kwargs,  # other timm embed_layer options, unused here
     ):
         super().__init__()
         img_size = expand_size(img_size)
@@ -58,7 +62,7 @@ class PatchEmbed(torch.nn.Module):
         self.flatten = flatten
 
         self.proj = torch.nn.Conv2d(
-            in_chans, embed_dim, kernel_size=patch_size, stride=patch_size
+            in_chans, embed_dim, kernel_size=patch_size, stride=patch_size, bias=bias
         )
         self.norm = norm_layer(embed_dim) if norm_layer else torch.nn.Identity()
 
@@ -74,14 +78,8 @@ class LocalViT(timm.models.vision_transformer.VisionTransformer):
     """Vision Transformer for M2D Audio"""
 
     def __init__(self, **kwargs):
-        super().__init__(**kwargs)
         # Workaround for PatchEmbed to avoid unintended assertion failure. ex) AssertionError: Input image width (102) doesn't match model (608).
-        self.patch_embed = PatchEmbed(
-            self.patch_embed.img_size,
-            self.patch_embed.patch_size,
-            self.patch_embed.proj.in_channels,
-            self.patch_embed.proj.out_channels,
-        )
+        super().__init__(embed_layer=PatchEmbed, **kwargs)
         self.norm_stats = torch.nn.Parameter(
             torch.tensor([-7.1, 4.2]), requires_grad=False
         )
@@ -141,13 +139,9 @@ def parse_sizes_by_name(name):
 
 
 def drop_non_model_weights(model, checkpoint, filename):
-    model_keys = [n for n, p in model.named_parameters()]
-    new_ckpt, dropped = {}, []
-    for k in checkpoint:
-        if k not in model_keys:
-            dropped.append(k)
-            continue
-        new_ckpt[k] = checkpoint[k]
+    model_keys = {n for n, _ in model.named_parameters()}
+    new_ckpt = {k: v for k, v in checkpoint.items() if k in model_keys}
+    dropped = [k for k in checkpoint if k not in model_keys]
     n_org = len(checkpoint.keys())
     n_cur = len(new_ckpt.keys())
     print(
@@ -221,17 +215,19 @@ def get_to_melspec(cfg):
     else:
         assert False, f"Unknown input size: {cfg.input_size}"
 
-    to_spec = nnAudio.features.MelSpectrogram(
-        sr=cfg.sample_rate,
+    # slaney mel scale/norm matches the librosa filterbank nnAudio used
+    to_spec = torchaudio.transforms.MelSpectrogram(
+        sample_rate=cfg.sample_rate,
         n_fft=cfg.n_fft,
         win_length=cfg.window_size,
         hop_length=cfg.hop_size,
         n_mels=cfg.n_mels,
-        fmin=cfg.f_min,
-        fmax=cfg.f_max,
+        f_min=cfg.f_min,
+        f_max=cfg.f_max,
+        power=2.0,
         center=True,
-        power=2,
-        verbose=False,
+        norm="slaney",
+        mel_scale="slaney",
     )
     logging.info(
         f"Runtime MelSpectrogram({cfg.sample_rate}, {cfg.n_fft}, {cfg.window_size}, {cfg.hop_size}, "
@@ -241,14 +237,21 @@ def get_to_melspec(cfg):
     return to_spec
 
 
+@torch.compile(dynamic=True)
+def log_normalize(x, mean, std):
+    # log, unsqueeze and normalization fused into a single elementwise kernel,
+    # rather than one pass over the spectrogram each
+    return ((x + _EPS_FP32).log().unsqueeze(1) - mean) / std
+
+
 def get_timestamps(cfg, batch_audio, x):  # Returns timestamps in milliseconds.
     audio_len = len(batch_audio[0])
     sec = audio_len / cfg.sample_rate
     x_len = len(x[0])
     step = sec / x_len * 1000  # sec -> ms
-    ts = torch.tensor([step * i for i in range(x_len)]).unsqueeze(0)
-    ts = ts.repeat(len(batch_audio), 1)
-    return ts
+    ts = torch.arange(x_len, device=x.device, dtype=torch.float32) * step
+    # a view, the rows are identical
+    return ts.unsqueeze(0).expand(len(batch_audio), -1)
 
 
 class MDuo(torch.nn.Module):
@@ -286,6 +289,17 @@ class MDuo(torch.nn.Module):
             mlp_ratio=4,
             norm_layer=partial(torch.nn.LayerNorm, eps=1e-6),
         )
+        # NHWC lets cuDNN pick its faster patch-embedding conv kernels
+        self.backbone = self.backbone.to(memory_format=torch.channels_last)
+        # normalization statistics as buffers, so that they follow the model
+        # across devices; updated from the checkpoint in load_state_dict
+        mean, std = self.backbone.norm_stats.detach().clone()
+        self.register_buffer("_mean", mean, persistent=False)
+        self.register_buffer("_std", std, persistent=False)
+        # patch geometry used by encode_lms, as plain ints
+        self._patch_fbins = int(self.backbone.grid_size()[0])
+        self._patch_frames = int(self.backbone.patch_size()[1])
+        self._embed_d = self.backbone.patch_embed.proj.out_channels
 
         # Set normalization statistics for backward compatibility. The [-7.1, 4.2] is for 2022 models.
 
@@ -307,6 +321,12 @@ class MDuo(torch.nn.Module):
 
         self.to_spec = get_to_melspec(self.cfg)
 
+        # encoder for full-length chunks, replaced by a compiled/traced version
+        # (see load_state_dict and to_torchscript)
+        self._encoder = self.backbone.forward_encoder
+        # side stream for spectrograms in forward_batches, created on first use
+        self._mel_stream = None
+
         # Create a ViT.
 
     def load_state_dict(self, state_dict, strict=True):
@@ -328,6 +348,8 @@ class MDuo(torch.nn.Module):
         self.cfg.mean, self.cfg.std = (
             self.backbone.state_dict()["norm_stats"].to("cpu").numpy()
         )
+        self._mean.copy_(self.backbone.norm_stats[0])
+        self._std.copy_(self.backbone.norm_stats[1])
         
         
         logging.info(f"Model input size: {self.cfg.input_size}")
@@ -336,68 +358,188 @@ class MDuo(torch.nn.Module):
         logging.info(f"Norm stats: {self.cfg.mean}, {self.cfg.std}")
 
         self.backbone.eval()
+        if self.feature_extractor:
+            self.backbone.requires_grad_(False)
+            # the frozen backbone is only used for inference, so let Inductor
+            # fold its weights as constants (the compile-time counterpart of
+            # torch.jit.freeze, see to_torchscript), fuse the encoder's
+            # kernels and, on GPU, capture them in a CUDA graph ("triton.
+            # cudagraphs" is what mode="reduce-overhead" turns on); chunk
+            # shapes are fixed by unit_frames
+            self._encoder = torch.compile(
+                self.backbone.forward_encoder,
+                options={"freezing": True, "triton.cudagraphs": True},
+                dynamic=False,
+            )
+
+    def to_torchscript(self):
+        """Replace the encoder used for full-length chunks with a traced and
+        frozen TorchScript version, for deployment inference. Call after
+        loading weights and moving the model to its device."""
+        example = torch.zeros(
+            1, 1, *self.cfg.input_size, device=self.backbone.pos_embed.device
+        )
+        traced = torch.jit.trace_module(
+            self.backbone.eval(), {"forward_encoder": example}
+        )
+        # optimize_for_inference freezes the module, folding its weights
+        self._traced_backbone = torch.jit.optimize_for_inference(
+            torch.jit.freeze(traced, preserved_attrs=["forward_encoder"]),
+            other_methods=["forward_encoder"],
+        )
+        self._encoder = self._traced_backbone.forward_encoder
+        return self
+
+    def _mel_spec(self, batch_audio):
+        # the spectrogram stays in fp32 even when called under an outer
+        # autocast: MelScale is a matmul, which autocast would run in bf16
+        with torch.autocast("cuda", enabled=False):
+            return self.to_spec(batch_audio)
 
     def to_log_mel_spec(self, batch_audio):
-        x = self.to_spec(batch_audio)
-        x = (x + torch.finfo().eps).log()
-        x = x.unsqueeze(1)
+        x = self._mel_spec(batch_audio)
+        x = (x + _EPS_FP32).log()
+        x = x.unsqueeze(1).to(memory_format=torch.channels_last)
         return x
 
     def normalize_batch(self, x):
-        x = (x - self.cfg.mean) / self.cfg.std
+        x = (x - self._mean) / self._std
         return x
 
     def to_normalized_feature(self, batch_audio):
-        x = self.to_log_mel_spec(batch_audio)
-        x = self.normalize_batch(x)
+        # same as normalize_batch(to_log_mel_spec(batch_audio)), in one kernel
+        x = self._mel_spec(batch_audio)
+        x = log_normalize(x, self._mean, self._std)
         return x
 
-    def encode_lms(self, x, average_per_time_frame=False):
-        patch_fbins = self.backbone.grid_size()[0]
+    def forward_chunk(self, x):
+        x = x.to(memory_format=torch.channels_last)
+        # compiled and traced encoders are specialized on full-length chunks,
+        # so a shorter trailing chunk goes through the eager encoder
+        # bf16 on GPU; the spectrogram itself is still computed in fp32
+        with torch.autocast("cuda", dtype=torch.bfloat16, enabled=x.is_cuda):
+            if x.shape[-1] == self.cfg.input_size[1]:
+                # always copy, since CUDA graph outputs are overwritten by the
+                # next replay
+                return self._encoder(x).to(torch.float32, copy=True)
+            return self.backbone.forward_encoder(x).float()
+
+    def encode_lms(self, x, average_per_time_frame=False, pooled=False):
+        patch_fbins = self._patch_fbins
         unit_frames = self.cfg.input_size[1]
-        patch_frames = self.backbone.patch_size()[1]
-        embed_d = self.backbone.patch_embed.proj.out_channels
-        n_chunk = (x.shape[-1] + unit_frames - 1) // unit_frames
-        pad_frames = (
-            patch_frames - (x.shape[-1] % unit_frames % patch_frames)
-        ) % patch_frames
+        patch_frames = self._patch_frames
+        embed_d = self._embed_d
+        # only pad to whole patches: padding the trailing chunk up to
+        # unit_frames would change its embeddings and the number of frames.
+        # unit_frames is a multiple of patch_frames, so this is the same as
+        # padding the remainder after the full-length chunks
+        pad_frames = -x.shape[-1] % patch_frames
         if pad_frames > 0:
             x = torch.nn.functional.pad(x, (0, pad_frames))
 
+        # encode all full-length chunks in a single batched call, followed by
+        # the shorter trailing chunk (if any)
+        n_full = x.shape[-1] // unit_frames
+        chunks = []
+        if n_full > 0:
+            full = x[..., : n_full * unit_frames]
+            # b c f (n t) -> (b n) c f t
+            b, c, f, _ = full.shape
+            full = (
+                full.view(b, c, f, n_full, unit_frames)
+                .permute(0, 3, 1, 2, 4)
+                .reshape(b * n_full, c, f, unit_frames)
+            )
+            chunks.append((full, n_full))
+        if x.shape[-1] > n_full * unit_frames:
+            chunks.append((x[..., n_full * unit_frames :], 1))
+
         embeddings = []
-        if self.cfg.flat_features:
-            # flatten all patch embeddings
-            for i in range(n_chunk):
-                emb = self.backbone.forward_encoder(
-                    x[..., i * unit_frames : (i + 1) * unit_frames]
-                )
-                emb = emb[..., 1:, :]
+        running_sum, total_frames = None, 0
+        for chunk, n in chunks:
+            emb = self.forward_chunk(chunk)
+            emb = emb[..., 1:, :]
+            # b (f t) d -> b f t d
+            emb_ftd = emb.view(emb.shape[0], patch_fbins, -1, embed_d)
+            if self.cfg.flat_features:
+                # flatten all patch embeddings
                 if average_per_time_frame:
-                    emb = rearrange(
-                        emb, "b (f t) d -> b t d f", f=patch_fbins, d=embed_d
-                    ).mean(-1)
-                embeddings.append(emb)
-        else:
-            # stack embeddings along time frame
-            for i in range(n_chunk):
-                emb = self.backbone.forward_encoder(
-                    x[..., i * unit_frames : (i + 1) * unit_frames]
+                    # b f t d -> b t d
+                    emb = emb_ftd.mean(1)
+            else:
+                # stack embeddings along time frame: b f t d -> b t (f d)
+                emb = emb_ftd.permute(0, 2, 1, 3).reshape(
+                    emb.shape[0], -1, patch_fbins * embed_d
                 )
-                emb = emb[..., 1:, :]
-                emb = rearrange(emb, "b (f t) d -> b t (f d)", f=patch_fbins, d=embed_d)
-                embeddings.append(emb)
+            if pooled:
+                # accumulate the temporal mean chunk by chunk, rather than
+                # concatenating all frames only to average them
+                frames_sum = emb.unflatten(0, (-1, n)).sum((1, 2))
+                running_sum = (
+                    frames_sum if running_sum is None else running_sum + frames_sum
+                )
+                total_frames += n * emb.shape[-2]
+                continue
+            # put the chunks of each item back in order: (b n) t d -> b (n t) d
+            emb = emb.reshape(-1, n * emb.shape[-2], emb.shape[-1])
+            embeddings.append(emb)
+        if pooled:
+            return running_sum / total_frames
         # concatenate embedding chunks in the time axis
         x = torch.cat(embeddings, axis=-2)
         return x
 
-    def encode(self, batch_audio, average_per_time_frame=False):
+    def encode(self, batch_audio, average_per_time_frame=False, pooled=False):
         x = self.to_normalized_feature(batch_audio)
-        return self.encode_lms(x, average_per_time_frame=average_per_time_frame)
+        return self.encode_lms(
+            x, average_per_time_frame=average_per_time_frame, pooled=pooled
+        )
 
     def forward(self, batch_audio, average_per_time_frame=False):
-        x = self.encode(batch_audio, average_per_time_frame=average_per_time_frame)
-        if self.extract_kws.get("pooled", True):
-            x = x.mean(dim=1)
+        # the backbone is eval-only when used as a feature extractor. no_grad
+        # rather than inference_mode, since features of raw items are fed
+        # straight into trainable downstream models
+        with torch.set_grad_enabled(not self.feature_extractor):
+            x = self.encode(
+                batch_audio,
+                average_per_time_frame=average_per_time_frame,
+                pooled=self.extract_kws.get("pooled", True),
+            )
+        return x
+
+    def forward_batches(self, batches):
+        """Same as calling forward on each batch of an iterable, yielding the
+        outputs in order. For CUDA batches, the spectrogram of the next batch
+        is computed on a side stream while the ViT encodes the current one."""
+        pending = None  # (features, event) of the previous CUDA batch
+        for batch_audio in batches:
+            if not batch_audio.is_cuda:
+                yield self(batch_audio)
+                continue
+            if self._mel_stream is None:
+                self._mel_stream = torch.cuda.Stream(device=batch_audio.device)
+            current_stream = torch.cuda.current_stream(batch_audio.device)
+            # the batch may still be being copied to the device
+            self._mel_stream.wait_stream(current_stream)
+            with torch.cuda.stream(self._mel_stream), torch.set_grad_enabled(
+                not self.feature_extractor
+            ):
+                x = self.to_normalized_feature(batch_audio)
+            batch_audio.record_stream(self._mel_stream)
+            event = self._mel_stream.record_event()
+            if pending is not None:
+                yield self._encode_pending(*pending)
+            pending = (x, event)
+        if pending is not None:
+            yield self._encode_pending(*pending)
+
+    def _encode_pending(self, x, event):
+        # wait only for this batch's spectrogram, not the one queued after it
+        current_stream = torch.cuda.current_stream(x.device)
+        current_stream.wait_event(event)
+        x.record_stream(current_stream)
+        with torch.set_grad_enabled(not self.feature_extractor):
+            x = self.encode_lms(x, pooled=self.extract_kws.get("pooled", True))
         return x
 
     def get_scene_embeddings(self, batch_audio):
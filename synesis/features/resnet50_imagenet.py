@@ -13,11 +13,35 @@ class ResNet50_ImageNet(nn.Module):
 
         self.encoder = resnet50(weights="IMAGENET1K_V2")
         self.encoder.fc = nn.Identity()
+        # NHWC lets cuDNN pick its faster conv kernels
+        self.encoder = self.encoder.to(memory_format=torch.channels_last)
+        # compiled separately from self.encoder, so that the eager module can
+        # still be traced (see to_torchscript) and its state_dict is unchanged.
+        # Only when used as a feature extractor, not while being trained
+        self._encoder = self.encoder.forward
+        if feature_extractor:
+            self._encoder = torch.compile(self._encoder)
+
+    def to_torchscript(self):
+        """Replace the compiled encoder with a traced and frozen TorchScript
+        version, for deployment inference. Call after moving the model to its
+        device."""
+        example = torch.zeros(
+            1, 3, 224, 224, device=self.encoder.conv1.weight.device
+        ).to(memory_format=torch.channels_last)
+        traced = torch.jit.trace(self.encoder.eval(), example)
+        # strips dropout and folds batch norms into the convolutions
+        self._encoder = torch.jit.optimize_for_inference(traced)
+        return self
 
     def forward(self, x):
         if self.feature_extractor:
+            x = x.to(memory_format=torch.channels_last)
+            # no_grad rather than inference_mode, since the features can be
+            # fed straight into a trainable downstream model
             with torch.no_grad():
-                h = self.encoder(x)
-                return h
+                with torch.autocast("cuda", dtype=torch.bfloat16, enabled=x.is_cuda):
+                    h = self._encoder(x)
+                return h.float()
         else:
             raise NotImplementedError("Training not implemented yet.")
@@ -4,7 +4,6 @@ covariate shift."""
 from pathlib import Path
 from typing import Optional
 
-import numpy as np
 import torch
 from torch import nn
 from torch.utils.data import DataLoader
@@ -21,10 +20,86 @@ from synesis.features.feature_utils import (
 )
 from synesis.metrics import instantiate_metrics
 from synesis.probes import get_probe
-from synesis.transforms.transform_utils import get_transform
+from synesis.transforms.transform_utils import ParametrizedTransform
 from synesis.utils import deep_update
 
 
+class _Prefetcher:
+    """Iterate over (inputs, targets) batches of a DataLoader with the inputs
+    moved to the device. On CUDA, the next batch is copied on a side stream
+    while the current one is being processed, so the loader should use
+    pinned memory."""
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type != "cuda":
+            for inputs, targets in self.loader:
+                yield inputs.to(self.device), targets
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        current_stream = torch.cuda.current_stream(self.device)
+
+        def copy(batch):
+            if batch is None:
+                return None
+            inputs, targets = batch
+            with torch.cuda.stream(stream):
+                inputs = inputs.to(self.device, non_blocking=True)
+            return inputs, targets
+
+        batches = iter(self.loader)
+        next_batch = copy(next(batches, None))
+        while next_batch is not None:
+            current_stream.wait_stream(stream)
+            inputs, targets = next_batch
+            # allocated on the side stream, but used on the current one
+            inputs.record_stream(current_stream)
+            next_batch = copy(next(batches, None))
+            yield inputs, targets
+
+
+def _loader_kwargs(num_workers, device):
+    """DataLoader options for decoding and collating in worker processes,
+    in pinned memory when running on CUDA (see _Prefetcher)."""
+    kwargs = {
+        "num_workers": num_workers,
+        "pin_memory": str(device).startswith("cuda"),
+    }
+    if num_workers > 0:
+        kwargs["prefetch_factor"] = 4
+    return kwargs
+
+
+@torch.compile(dynamic=True)
+def cosine_distance(a, b):
+    # Inductor fuses the norms, dot product and subtraction into a single
+    # per-row reduction, rather than one kernel for each
+    a = torch.nn.functional.normalize(a, dim=-1, eps=1e-8)
+    b = torch.nn.functional.normalize(b, dim=-1, eps=1e-8)
+    return 1 - (a * b).sum(dim=-1)
+
+
+@torch.compile(dynamic=True)
+def euclidean_distance(a, b):
+    # row-wise, so only the B distances are computed (not the B x B matrix);
+    # like cosine_distance, broadcasts over leading dims
+    return torch.nn.functional.pairwise_distance(a, b)
+
+
+@torch.compile(dynamic=True)
+def entropy(logits):
+    # softmax, log, product and sum fused into a single kernel
+    probs = torch.softmax(logits, dim=1)
+    return -(probs * torch.log(probs + 1e-10)).sum(dim=1)
+
+
 def train(
     feature: str,
     dataset: str,
@@ -89,6 +164,7 @@ def evaluate_feature_distance(
     item_format: str = "feature",
     device: Optional[str] = None,
     batch_size: int = 32,
+    num_workers: int = 0,
 ):
     """
     Evaluate how much features change when
@@ -105,6 +181,8 @@ def evaluate_feature_distance(
         transform: Name of the transform (factor of variation).
         device: Device to use for evaluation (defaults to "cuda" if available).
         batch_size: Batch size for evaluation.
+        num_workers: Number of data loading worker processes. Defaults to 0,
+                i.e. loading in the main process.
     """
     feature_config = feature_configs.get(feature)
     transform_config = transform_configs.get(transform)
@@ -140,6 +218,7 @@ def evaluate_feature_distance(
         clean_dataset,
         batch_sampler=clean_sampler,
         collate_fn=collate_packed_batch,
+        **_loader_kwargs(num_workers, device),
     )
 
     transform_sampler = DynamicBatchSampler(
@@ -149,6 +228,7 @@ def evaluate_feature_distance(
         transform_dataset,
         batch_sampler=transform_sampler,
         collate_fn=collate_packed_batch,
+        **_loader_kwargs(num_workers, device),
     )
 
     feature_extractor = get_feature_extractor(feature)
@@ -157,62 +237,46 @@ def evaluate_feature_distance(
     # We will iterate over all degrees of the transform, computing distances
     # for all features in the dataset for each.
 
-    # for each transform, there's a param starting from "min" and one from "max"
-    # that we need to find in order to define the first and last transform
-    min_key = ""
-    max_key = ""
-    transform_params = transform_config["params"]
-    for key in transform_params:
-        if key.startswith("min"):
-            min_key = key
-            max_key = key.replace("min", "max")
-            break
-    if not min_key or not max_key:
-        raise (ValueError("Could not find min and max keys in transform params"))
-
-    param_values = range(
-        transform_config["params"][min_key],
-        transform_config["params"][max_key],
-        transform_config["step"],
-    )
-
-    results = {}
-    # Evaluation loop
-    for pv in param_values:
-        # Replace parameter range with the specific value for both min and maxs
-        controlled_transform_config = transform_config.copy()
-        controlled_transform_config["params"][min_key] = pv
-        controlled_transform_config["params"][max_key] = pv
-        transform_obj = get_transform(controlled_transform_config)
-
-        # Iterate through clean embeddings and raw data, transforming the raw data
-        # and computing features from them.
-        for (clean_rep_batch, _), (raw_batch, _) in zip(clean_loader, transform_loader):
-            raw_batch = raw_batch.to(device)
-            clean_rep_batch = clean_rep_batch.to(device)
-
-            transformed_raw_data, _ = transform_obj(raw_batch)
+    # built once, with the transform parameter given per call
+    transform_obj = ParametrizedTransform(transform_config)
+    param_values = transform_obj.param_values
+
+    # Evaluation loop: each clean/raw batch pair is loaded once, and the raw
+    # batch is transformed with every parameter value. Clean features don't
+    # depend on the parameter, so nothing is re-read per value.
+    # Distances are accumulated on the device per parameter value, syncing
+    # once at the end rather than once per batch.
+    dist_sums = torch.zeros(len(param_values), device=device)
+    dist_count = 0
+    for (clean_rep_batch, _), (raw_batch, _) in zip(
+        _Prefetcher(clean_loader, device), _Prefetcher(transform_loader, device)
+    ):
+        transformed_rep_batches = []
+        for pv in param_values:
+            transformed_raw_data = transform_obj(raw_batch, param=pv)
+            # feature extractors autocast their own encoders on GPU (and keep
+            # e.g. spectrograms in fp32); the distances are reduced in fp32
             transformed_rep_batch = feature_extractor(transformed_raw_data)
-
-            # Compute distance between clean and transformed features.
-            if metric == "cosine":
-                dist = 1 - torch.nn.functional.cosine_similarity(
-                    clean_rep_batch, transformed_rep_batch
-                )
-            elif metric == "euclidean":
-                dist = torch.nn.functional.pairwise_distance(
-                    clean_rep_batch, transformed_rep_batch
-                )
-            else:
-                raise ValueError(f"Unknown metric: {metric}")
-
-            if pv not in results:
-                results[pv] = []
-            results[pv].append(dist.mean().item())
-
-    # average distances for each pv
-    for pv in results:
-        results[pv] = sum(results[pv]) / len(results[pv])
+            transformed_rep_batches.append(transformed_rep_batch.float())
+        # (k, b, d), for k parameter values
+        transformed_rep_batches = torch.stack(transformed_rep_batches)
+
+        # Compute distances between clean and transformed features for all
+        # parameter values at once, broadcasting the clean features over k.
+        if metric == "cosine":
+            dist = cosine_distance(clean_rep_batch, transformed_rep_batches)
+        elif metric == "euclidean":
+            dist = euclidean_distance(clean_rep_batch, transformed_rep_batches)
+        else:
+            raise ValueError(f"Unknown metric: {metric}")
+
+        dist_sums += dist.sum(dim=1)
+        dist_count += dist.shape[1]
+
+    # average distance over all items for each pv
+    results = {}
+    if dist_count:
+        results = dict(zip(param_values, (dist_sums / dist_count).tolist()))
 
     return results
 
@@ -227,6 +291,7 @@ def evaluate_model_predictions(
     item_format: str = "raw",
     device: Optional[str] = None,
     batch_size: int = 32,
+    num_workers: int = 0,
 ):
     """
     Evaluate downstream model predictions when the input is
@@ -243,6 +308,8 @@ def evaluate_model_predictions(
         transform: Name of the transform (factor of variation).
         device: Device to use for evaluation (defaults to "cuda" if available).
         batch_size: Batch size for evaluation.
+        num_workers: Number of data loading worker processes. Defaults to 0,
+                i.e. loading in the main process.
     """
     feature_config = feature_configs.get(feature)
     transform_config = transform_configs.get(transform)
@@ -270,6 +337,7 @@ def evaluate_model_predictions(
         test_dataset,
         batch_sampler=test_sampler,
         collate_fn=collate_packed_batch,
+        **_loader_kwargs(num_workers, device),
     )
 
     metrics = instantiate_metrics(
@@ -280,66 +348,57 @@ def evaluate_model_predictions(
     # We will iterate over all degrees of the transform, computing distances
     # for all features in the dataset for each.
 
-    # for each transform, there's a param starting from "min" and one from "max"
-    # that we need to find in order to define the first and last transform
-    min_key = ""
-    max_key = ""
-    transform_params = transform_config["params"]
-    for key in transform_params:
-        if key.startswith("min"):
-            min_key = key
-            max_key = key.replace("min", "max")
-            break
-    if not min_key or not max_key:
-        raise (ValueError("Could not find min and max keys in transform params"))
-
-    param_values = range(
-        transform_config["params"][min_key],
-        transform_config["params"][max_key],
-        transform_config["step"],
-    )
+    # built once, with the transform parameter given per call
+    transform_obj = ParametrizedTransform(transform_config)
+    param_values = transform_obj.param_values
+
+    # The test batches are the same for every parameter value, so decode and
+    # collate them once, keeping them in (pinned) host memory.
+    test_batches = list(test_loader)
+    # neither do the targets, so concatenate them once
+    test_targets = torch.cat([targets for _, targets in test_batches], dim=0)
 
     # Evaluation loop
     model.to(device)
     model.eval()
+    # the model is only run for inference here, so compile it once for all
+    # parameter values; outputs are used (and copied) before the next call
+    predict = torch.compile(model, mode="reduce-overhead")
     results = {}
 
     for pv in param_values:
-        # Replace parameter range with the specific value for both min and maxs
-        controlled_transform_config = transform_config.copy()
-        controlled_transform_config["params"][min_key] = pv
-        controlled_transform_config["params"][max_key] = pv
-
         # Iterate through clean embeddings and raw_data , transforming the raw_data
         # and computing features from it.
-        total_loss = 0
-        test_outputs = []
-        test_targets = []
-        with torch.no_grad():
-            for raw_batch, targets in test_loader:
-                raw_batch = raw_batch.to(device)
-
-                transform_obj = get_transform(controlled_transform_config)
-                transformed_raw_data, _ = transform_obj(raw_batch)
-
-                with torch.no_grad():
-                    output = model(transformed_raw_data)
-                    total_loss += model.loss(output, targets).item()
-
-                # Store outputs and targets for metric calculation
-                test_outputs.append(output)
-                test_targets.append(targets)
-
-        # Concatenate all outputs and targets
-        test_outputs = torch.cat(test_outputs, dim=0)
-        test_targets = torch.cat(test_targets, dim=0)
+        total_loss = torch.zeros((), device=device)
+        # outputs are written into a single buffer, allocated on the first batch
+        test_outputs = None
+        offset = 0
+        with torch.inference_mode():
+            for raw_batch, targets in _Prefetcher(test_batches, device):
+                transformed_raw_data = transform_obj(raw_batch, param=pv)
+
+                # bf16 on GPU; the loss and metrics are computed in fp32
+                with torch.autocast(
+                    "cuda", dtype=torch.bfloat16, enabled=transformed_raw_data.is_cuda
+                ):
+                    output = predict(transformed_raw_data)
+                output = output.float()
+                total_loss += model.loss(output, targets)
+
+                # Store outputs for metric calculation
+                if test_outputs is None:
+                    test_outputs = output.new_empty(
+                        (len(test_targets), *output.shape[1:])
+                    )
+                test_outputs[offset : offset + len(output)] = output
+                offset += len(output)
 
         # Calculate metrics
         results[pv] = {}
         for metric_cfg, metric in zip(task_config["evaluation"]["metrics"], metrics):
             results[pv][metric_cfg["name"]] = metric(test_outputs, test_targets).item()
 
-        avg_loss = total_loss / len(test_loader)
+        avg_loss = total_loss.item() / len(test_batches)
         print(f"Avg test loss: {avg_loss:.4f}")
 
         for name, value in results.items():
@@ -359,6 +418,7 @@ def evaluate_prediction_uncertainty(
     item_format: str = "raw",
     device: Optional[str] = None,
     batch_size: int = 32,
+    num_workers: int = 0,
 ):
     """
     Evaluate model prediction uncertainty when the input is transformed.
@@ -375,6 +435,8 @@ def evaluate_prediction_uncertainty(
         transform: Name of the transform (factor of variation).
         device: Device to use for evaluation (defaults to "cuda" if available).
         batch_size: Batch size for evaluation.
+        num_workers: Number of data loading worker processes. Defaults to 0,
+                i.e. loading in the main process.
     """
     feature_config = feature_configs.get(feature)
     transform_config = transform_configs.get(transform)
@@ -398,68 +460,65 @@ def evaluate_prediction_uncertainty(
         test_dataset,
         batch_size=batch_size,
         collate_fn=collate_packed_batch,
+        **_loader_kwargs(num_workers, device),
     )
 
     # We will iterate over all degrees of the transform, computing distances
     # for all features in the dataset for each.
 
-    # for each transform, there's a param starting from "min" and one from "max"
-    # that we need to find in order to define the first and last transform
-    min_key = ""
-    max_key = ""
-    transform_params = transform_config["params"]
-    for key in transform_params:
-        if key.startswith("min"):
-            min_key = key
-            max_key = key.replace("min", "max")
-            break
-    if not min_key or not max_key:
-        raise (ValueError("Could not find min and max keys in transform params"))
-
-    param_values = range(
-        transform_config["params"][min_key],
-        transform_config["params"][max_key],
-        transform_config["step"],
-    )
+    # built once, with the transform parameter given per call
+    transform_obj = ParametrizedTransform(transform_config)
+    param_values = transform_obj.param_values
+
+    # The test batches are the same for every parameter value, so decode and
+    # collate them once, keeping them in (pinned) host memory.
+    test_batches = list(test_loader)
+    # items may be split into several subitems, so count the collated ones
+    n_subitems = sum(len(targets) for _, targets in test_batches)
 
     results = {}
     model.eval()
+    # the model is only run for inference here, so compile it once for all
+    # parameter values; outputs are used (and copied) before the next call
+    predict = torch.compile(model, mode="reduce-overhead")
 
     for pv in param_values:
-        # Replace parameter range with the specific value for both min and maxs
-        controlled_transform_config = transform_config.copy()
-        controlled_transform_config["params"][min_key] = pv
-        controlled_transform_config["params"][max_key] = pv
-        transform_obj = get_transform(controlled_transform_config)
-
-        uncertainties = []
-
-        with torch.no_grad():
-            for raw_batch, _ in test_loader:
-                raw_batch = raw_batch.to(device)
+        # filled on the device, one slice per batch
+        uncertainties = torch.empty(n_subitems, device=device)
+        offset = 0
 
+        with torch.inference_mode():
+            for raw_batch, _ in _Prefetcher(test_batches, device):
                 # Apply transform
-                transformed_raw_data, _ = transform_obj(raw_batch)
+                transformed_raw_data = transform_obj(raw_batch, param=pv)
 
-                # Get model predictions
-                logits = model(transformed_raw_data)
-                probs = torch.softmax(logits, dim=1)
+                # Get model predictions, in bf16 on GPU; the uncertainty is
+                # computed in fp32
+                with torch.autocast(
+                    "cuda", dtype=torch.bfloat16, enabled=transformed_raw_data.is_cuda
+                ):
+                    logits = predict(transformed_raw_data)
+                logits = logits.float()
 
                 # Compute uncertainty
                 if uncertainty_metric == "entropy":
-                    uncertainty = -(probs * torch.log(probs + 1e-10)).sum(dim=1)
+                    uncertainty = entropy(logits)
                 elif uncertainty_metric == "max_prob":
+                    probs = torch.softmax(logits, dim=1)
                     uncertainty = 1 - probs.max(dim=1)[0]
                 else:
                     raise ValueError(
                         f"Unknown uncertainty metric: {uncertainty_metric}"
                     )
 
-                uncertainties.extend(uncertainty.cpu().numpy())
+                n = uncertainty.numel()
+                uncertainties[offset : offset + n] = uncertainty
+                offset += n
 
         results[pv] = {
-            "mean": float(np.mean(uncertainties)),
-            "std": float(np.std(uncertainties)),
+            "mean": uncertainties.mean().item(),
+            # population std, as np.std
+            "std": uncertainties.std(correction=0).item(),
         }
 
     return results
@@ -4,9 +4,54 @@
 def get_transform(transform_config, **kwargs):
     """Get transform from config."""
     transform_class = transform_config["class"]
-    transform_params = transform_config["params"]
-    if kwargs:
-        transform_params.update(kwargs)
+    # copy, so that overrides don't leak into the shared config
+    transform_params = {**transform_config["params"], **kwargs}
     transform_params["output_type"] = "tensor"
     transform = transform_class(**transform_params)
     return transform
+
+
+def _resolve_param_range(params, step):
+    """Find the min/max param pair of a transform, and the values from
+    min to max (exclusive) with the given step."""
+    # for each transform, there's a param starting from "min" and one
+    # from "max" that define the first and last transform
+    min_key = next((key for key in params if key.startswith("min")), "")
+    max_key = min_key.replace("min", "max")
+    if not min_key or max_key not in params:
+        raise ValueError("Could not find min and max keys in transform params")
+    return min_key, max_key, range(params[min_key], params[max_key], step)
+
+
+class ParametrizedTransform:
+    """Transform whose parameter range is collapsed to a single value,
+    given at call time.
+
+    The range is defined by the "min"/"max" param pair of the config
+    (e.g. min_transpose_semitones and max_transpose_semitones), and
+    param_values spans it with the config's step.
+
+    Args:
+        transform_config: Transform configuration.
+        **kwargs: Additional transform params (e.g. sample_rate).
+    """
+
+    def __init__(self, transform_config, **kwargs):
+        self.transform_config = transform_config
+        self.kwargs = kwargs
+
+        self.min_key, self.max_key, self.param_values = _resolve_param_range(
+            transform_config["params"], transform_config["step"]
+        )
+        self._transforms = {}
+
+    def __call__(self, x, param):
+        # transforms may precompute from their range when built (e.g.
+        # PitchShift's fast shifts), so build one per value and reuse it
+        if param not in self._transforms:
+            self._transforms[param] = get_transform(
+                self.transform_config,
+                **self.kwargs,
+                **{self.min_key: param, self.max_key: param},
+            )
+        return self._transforms[param](x)
@@ -1,3 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import product
+
 import numpy as np
 import pytest
 import torch
@@ -10,50 +14,58 @@ from synesis.datasets.mtgjamendo import MTGJamendo
 from synesis.datasets.giantsteps_key import GiantstepsKey
 from synesis.datasets.tinysol import TinySOL
 
-DATASETS = [
-    (
-        MagnaTagATune,
-        {
-            "root": "data/MagnaTagATune",
-            "splits": [None, "train", "test", "validation"],
-            "item_format": "raw",
-        },
-    ),
-    (
-        MTGJamendo,
-        {
-            "root": "data/MTGJamendo",
-            "data_path": "/import/c4dm-datasets/mtg-jamendo-raw/mtg-jamendo-dataset/mp3",
-            "splits": [None, "train", "test", "validation"],
-            "subsets": [None, "top50tags", "genre", "instrument", "moodtheme"],
-            "item_format": "raw",
-        },
-    ),
-    (
-        TinySOL,
-        {
-            "root": "data/TinySOL",
-            "splits": [None, "train", "test", "validation"],
-            "item_format": "raw",
-        },
-    ),
-    (
-        TinySOL,
-        {
-            "root": "data/TinySOL",
-            "splits": [None, "train", "test", "validation"],
-            "item_format": "raw",
-        },
-    ),
-    (
-        GiantstepsKey,
-        {
-            "root": "data/GiantStepsKey",
-            "splits": [None, "train", "test", "validation"],
-            "item_format": "raw",
-        },
-    ),
-]
+DATASETS = {
+    MagnaTagATune: {
+        "root": "data/MagnaTagATune",
+        "splits": [None, "train", "test", "validation"],
+        "item_format": "raw",
+    },
+    MTGJamendo: {
+        "root": "data/MTGJamendo",
+        "data_path": "/import/c4dm-datasets/mtg-jamendo-raw/mtg-jamendo-dataset/mp3",
+        "splits": [None, "train", "test", "validation"],
+        "subsets": [None, "top50tags", "genre", "instrument", "moodtheme"],
+        "item_format": "raw",
+    },
+    TinySOL: {
+        "root": "data/TinySOL",
+        "splits": [None, "train", "test", "validation"],
+        "item_format": "raw",
+    },
+    GiantstepsKey: {
+        "root": "data/GiantStepsKey",
+        "splits": [None, "train", "test", "validation"],
+        "item_format": "raw",
+    },
+}
+MTGJAMENDO_CONFIG = DATASETS[MTGJamendo]
+# upper bounds on median __getitem__ latency (s), per item format. These are
+# loose on purpose, to catch e.g. an extra copy per item rather than noise.
+GETITEM_LATENCY = {"raw": 0.5}
+
+
+def _make_dataset(
+    DatasetClass, root, split, item_format, itemization=True, subset=None
+):
+    """Build a dataset once and share it between tests. Tests only read
+    from the returned dataset, so sharing it is safe."""
+    # lru_cache keys on how the arguments are passed, so always pass them to
+    # the cached builder positionally, with defaults filled in
+    return _build_dataset(DatasetClass, root, split, item_format, itemization, subset)
+
+
+@lru_cache(maxsize=None)
+def _build_dataset(DatasetClass, root, split, item_format, itemization, subset):
+    # only MTGJamendo takes a subset
+    kwargs = {"subset": subset} if subset else {}
+    return DatasetClass(
+        feature="VGGishMTAT",
+        root=root,
+        item_format=item_format,
+        itemization=itemization,
+        split=split,
+        **kwargs,
+    )
 
 
 class MockDataset(Dataset):
@@ -92,21 +104,42 @@ class MockDataset(Dataset):
         return self.items[idx], "mock_label"
 
 
-@pytest.fixture(params=DATASETS)
-def dataset_config(request):
+@pytest.fixture(
+    scope="session",
+    params=[
+        (DatasetClass, config, split)
+        for DatasetClass, config in DATASETS.items()
+        for split in config["splits"]
+    ],
+    ids=lambda param: f"{param[0].__name__}-{param[2]}",
+)
+def dataset_split(request):
     return request.param
 
 
-@pytest.fixture(params=[True, False])
+@pytest.fixture(scope="session", params=[True, False])
 def itemization(request):
     return request.param
 
 
-@pytest.fixture(params=["raw"])
+@pytest.fixture(scope="session", params=["raw"])
 def item_format(request):
     return request.param
 
 
+@pytest.fixture(scope="session")
+def rng():
+    """One seeded generator for all tests, so failures are reproducible."""
+    return np.random.default_rng(0xC0FFEE)
+
+
+@pytest.fixture(scope="session")
+def dataset(dataset_split, itemization, item_format):
+    """Build each (dataset, split) once per session."""
+    DatasetClass, config, split = dataset_split
+    return _make_dataset(DatasetClass, config["root"], split, item_format, itemization)
+
+
 def test_subitem_wrapper():
     dataset = MockDataset()
     subitem_dataset = SubitemDataset(dataset)
@@ -156,68 +189,84 @@ def test_aggregate_wrapper():
     assert item[1][0][1] == 3.5, "Second item should be (3+4)/2"
 
 
-def test_dataset_loading(dataset_config, itemization, item_format):
-    DatasetClass, config = dataset_config
-    for split in config["splits"]:
-        dataset = DatasetClass(
-            feature="VGGishMTAT",
-            root=config["root"],
-            item_format=item_format,
-            itemization=itemization,
-            split=split,
-        )
-
-        # Test paths and labels are loaded
-        assert len(dataset.paths) > 0
-        assert len(dataset.raw_data_paths) > 0
-        assert len(dataset.feature_paths) > 0
-        assert len(dataset.labels) > 0
-        assert len(dataset.paths) == len(dataset.labels)
-        assert dataset.labels.dtype == torch.long
-
-        # Test random items
-        for _ in range(5):
-            idx = np.random.randint(0, len(dataset))
-            item, label = dataset[idx]
-            assert torch.is_tensor(item)
-            assert torch.is_tensor(label)
-            assert label.dtype == torch.long
-
-            if itemization:
-                # each item in batch will have a channel dim
-                assert len(item.shape) == 3
-                # each item will be the same length
-                assert all(subitem.shape[1] == item[0].shape[1] for subitem in item)
-                # all items have a channel dim of 1
-                assert all(subitem.shape[0] == 1 for subitem in item)
-            else:
-                assert len(item.shape) == 2
-                assert item.shape[0] == 1
-
-
-def test_mtgjamendo_subsets():
-    config = next(conf for cls, conf in DATASETS if cls == MTGJamendo)
-    for subset in config["subsets"]:
-        for split in config["splits"]:
-            dataset = MTGJamendo(
-                feature="VGGishMTAT",
-                root=config["root"],
-                item_format=config["item_format"][0],
-                split=split,
-                subset=subset,
-            )
+def _assert_label_array(labels, n):
+    """Labels should be one long tensor, with a row per path."""
+    assert type(labels) is torch.Tensor
+    assert labels.dtype is torch.long
+    assert labels.shape[0] == n > 0
+    # indexing rows out of a strided view would copy on every __getitem__
+    assert labels.is_contiguous()
+
+
+def test_dataset_loading(dataset, itemization, rng):
+    # Test paths and labels are loaded
+    n = len(dataset)
+    assert n > 0
+    assert len(dataset.raw_data_paths) > 0
+    assert len(dataset.feature_paths) > 0
+    _assert_label_array(dataset.labels, n)
+
+    # Test random items
+    idxs = rng.integers(0, n, size=5).tolist()
+    # items are read from disk, so overlap the reads
+    with ThreadPoolExecutor(max_workers=len(idxs)) as executor:
+        items_labels = list(executor.map(dataset.__getitem__, idxs))
+    assert all(isinstance(item, torch.Tensor) for item, _ in items_labels)
+    assert all(isinstance(label, torch.Tensor) for _, label in items_labels)
+    assert all(label.dtype is torch.long for _, label in items_labels)
+    # not needed for correctness, but a non-contiguous or non-fp32 item gets
+    # copied again on every pin_memory/device transfer
+    assert all(item.is_contiguous() for item, _ in items_labels)
+    assert all(item.dtype is torch.float32 for item, _ in items_labels)
+
+    for item, _ in items_labels:
+        if itemization:
+            # each item in batch will have a channel dim
+            assert item.dim() == 3
+            # each item will be the same length
+            assert all(subitem.size(1) == item.size(2) for subitem in item)
+            # all items have a channel dim of 1
+            assert all(subitem.size(0) == 1 for subitem in item)
+        else:
+            assert item.dim() == 2
+            assert item.size(0) == 1
+
+
+@pytest.mark.benchmark(group="getitem")
+def test_getitem_latency(benchmark, dataset, item_format):
+    # opt-in (pytest -m benchmark), since wall-clock bounds depend on the disk
+    benchmark(dataset.__getitem__, 0)
+    # no stats when benchmarking is disabled, e.g. under xdist
+    if not benchmark.disabled:
+        assert benchmark.stats.stats.median < GETITEM_LATENCY[item_format]
+
+
+@pytest.mark.parametrize(
+    ("subset", "split"),
+    list(product(MTGJAMENDO_CONFIG["subsets"], MTGJAMENDO_CONFIG["splits"])),
+)
+@pytest.mark.parametrize("item_format", [MTGJAMENDO_CONFIG["item_format"], "feature"])
+def test_mtgjamendo_subsets(subset, split, item_format):
+    dataset = _make_dataset(
+        MTGJamendo,
+        MTGJAMENDO_CONFIG["root"],
+        split,
+        item_format,
+        subset=subset,
+    )
+    assert len(dataset) > 0, f"Empty dataset for subset: {subset}, split: {split}"
+    if hasattr(dataset, "metadata_path"):
+        # subset and split are encoded in the file name, e.g.
+        # autotagging_genre-train.tsv
+        metadata_name = dataset.metadata_path.name
+        if subset:
+            assert (
+                subset in metadata_name
+            ), f"Subset {subset} not in metadata path for split {split}"
+        if split:
             assert (
-                len(dataset) > 0
-            ), f"Empty dataset for subset: {subset}, split: {split}"
-            if hasattr(dataset, "metadata_path"):
-                if subset:
-                    assert str(subset) in str(
-                        dataset.metadata_path
-                    ), f"Subset {subset} not in metadata path for split {split}"
-                if split:
-                    assert str(split) in str(
-                        dataset.metadata_path
-                    ), f"Split {split} not in metadata path for subset {subset}"
+                split in metadata_name
+            ), f"Split {split} not in metadata path for subset {subset}"
 
 
 if __name__ == "__main__":
@@ -12,25 +12,49 @@ from synesis.features.feature_utils import (
 )
 
 
-@pytest.fixture(params=[TinySOL])
+@pytest.fixture(scope="session", params=[TinySOL])
 def dataset_class(request):
     return request.param
 
 
-@pytest.fixture(params=feature_configs.keys())
+@pytest.fixture(scope="session", params=feature_configs.keys())
 def feature_name(request):
     return request.param
 
 
-def test_feature_extraction(dataset_class, feature_name, tmp_path):
+@pytest.fixture(scope="session")
+def dataset_root(dataset_class):
+    """Download each dataset once per session."""
+    root = f"data/{dataset_class.__name__}"
+    dataset_class(
+        feature=next(iter(feature_configs)),
+        root=root,
+        item_format="raw",
+        itemization=False,
+        split=None,
+        download=True,
+        **dataset_configs[dataset_class.__name__],
+    )
+    return root
+
+
+@pytest.fixture(scope="session")
+def feature_extractor(feature_name):
+    """Load each pretrained model once per session."""
+    return get_feature_extractor(feature_name)
+
+
+def test_feature_extraction(
+    dataset_class, dataset_root, feature_name, feature_extractor, tmp_path
+):
     # Set up dataset with the correct feature
     dataset = dataset_class(
         feature=feature_name,
-        root=f"data/{dataset_class.__name__}",
+        root=dataset_root,
         item_format="raw",
         itemization=False,
         split=None,
-        download=True,
+        download=False,
         **dataset_configs[dataset_class.__name__],
     )
 
@@ -52,7 +76,7 @@ def test_feature_extraction(dataset_class, feature_name, tmp_path):
     print(f"Using device: {device}")
 
     # Get the pretrained model
-    model = get_feature_extractor(feature_name)
+    model = feature_extractor
 
     # Test if model is in eval mode
     assert not model.training, f"Model {feature_name} should be in eval mode"
@@ -75,8 +99,9 @@ def test_feature_extraction(dataset_class, feature_name, tmp_path):
     for feature_path in dataset.feature_paths:
         assert feature_path.exists(), f"Feature file {feature_path} not created"
 
-        # Load the extracted feature
-        feature = torch.load(feature_path, weights_only=True)
+        # Load the extracted feature, memory-mapped since only its shape and
+        # a nonzero check are needed
+        feature = torch.load(feature_path, weights_only=True, mmap=True)
 
         # Check feature shape
         assert feature.ndim == 2, f"Feature {feature_path} should be 2-dimensional"